@@ -3,11 +3,12 @@ from flask import Response, request, stream_with_context
 import os
 from json_from_s3_file import get_json_from_s3_file, upload_json_to_s3
 from embedding import process_s3_json
-from query import hybrid_search, generate_answer_with_sources
+from query import hybrid_search, stream_answer_with_sources
 import boto3
 from flask_cors import CORS
 from extract_structured import parse_chunks, get_chunks_from_s3_file, upload_structured_to_s3
 import json, re
+import orjson
 from botocore.exceptions import ClientError
 from waitress import serve
 
@@ -169,6 +170,10 @@ def process():
         print(f"Error during processing: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _sse(obj) -> bytes:
+    """One server-sent event frame carrying `obj` as JSON."""
+    return b"data: " + orjson.dumps(obj) + b"\n\n"
+
 @app.route("/ask", methods=["GET"])
 def ask_question_stream():
     q = request.args.get("question", "")
@@ -176,31 +181,32 @@ def ask_question_stream():
 
     def generate():
         try:
-            yield "data: " + json.dumps({"status": "🔍 Retrieving patient record"}) + "\n\n"
+            yield _sse({"status": "🔍 Retrieving patient record"})
             search_result = hybrid_search(q, session_id=session_id, top_k=5)
             contexts, processed_query = search_result
 
-            yield "data: " + json.dumps({"status": "📖 Extracting highlights"}) + "\n\n"
+            yield _sse({"status": "📖 Extracting highlights"})
             contexts_preview = []
             for i, c in enumerate(contexts):
                 if isinstance(c, dict) and "text" in c:
                     contexts_preview.append({"text": c["text"][:200]})
 
-            yield "data: " + json.dumps({"status": "🤖 Generating answer"}) + "\n\n"
-            answer, sources, suggestions = generate_answer_with_sources(
-                q, contexts, session_id, processed_query
-            )
+            yield _sse({"status": "🤖 Generating answer"})
+            for event in stream_answer_with_sources(q, contexts, session_id, processed_query):
+                if "token" in event:
+                    yield _sse(event)
+                    continue
 
-            payload = {
-                "question": q,
-                "answer": answer,
-                "sources": sources,
-                "suggestions": suggestions
-            }
-            yield "data: " + json.dumps(payload) + "\n\n"
+                payload = {
+                    "question": q,
+                    "answer": event["answer"],
+                    "sources": event["sources"],
+                    "suggestions": event["suggestions"]
+                }
+                yield _sse(payload)
 
         except Exception as e:
-            yield "data: " + json.dumps({"error": str(e)}) + "\n\n"
+            yield _sse({"error": str(e)})
 
     return Response(stream_with_context(generate()), mimetype="text/event-stream")
 
@@ -171,6 +171,16 @@ export default function Chat() {
             ...h.filter(m => m.role !== "assistant_temp"),
             { role: "assistant_temp", content: `${data.status} …` } // you can animate the dots in UI
           ]);
+        } else if (data.token !== undefined) {
+          // ✍️ Append streamed answer tokens to the temp bubble
+          setChatHistory(h => {
+            const last = h[h.length - 1];
+            const partial = last?.role === "assistant_temp" && last.streaming ? last.content : "";
+            return [
+              ...h.filter(m => m.role !== "assistant_temp"),
+              { role: "assistant_temp", content: partial + data.token, streaming: true }
+            ];
+          });
         } else if (data.answer) {
           evtSource.close();
           // ✅ Replace temp status bubble with final answer
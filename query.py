@@ -1,24 +1,46 @@
+import ahocorasick
 import boto3
-import json
+import functools
 import os
 import time
 import botocore
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 import faiss
 import numpy as np
+import orjson
 import spacy
+from embedding import to_cosine_index
 from typing import List, Dict, Optional
 from urllib.parse import quote
 import re
-from collections import defaultdict
+import threading
+from collections import defaultdict, OrderedDict
+from dataclasses import dataclass, replace
+import hashlib
+
+_EMOJI_RE = re.compile(r'[^\w\s,.?-]')
 
 def remove_emojis(text):
-    return re.sub(r'[^\w\s,.?-]', '', text)
+    return _EMOJI_RE.sub('', text)
+
+# Precompiled detectors for pronouns / patient references in a question
+_PRONOUN_DETECT = re.compile(r"\b(his|her|their|he|she|they|him|them)\b", re.IGNORECASE)
+_CONTEXT_PRONOUN_DETECT = re.compile(r"\b(his|her|their|he|she|they|him|them|it|this|that)\b", re.IGNORECASE)
+_PATIENT_INDICATOR_DETECT = re.compile(r"\b(his|her|their|he|she|they|him|them|patient|it|this|that|its)\b", re.IGNORECASE)
+_PATIENT_TERM_DETECT = re.compile(r"patient", re.IGNORECASE)
+# Pronouns resolved to the current patient, in one pass (see update_patient_context)
+_PRONOUN_RESOLVE = re.compile(r"\b(the patient|this patient|his|her|their|he|she|they|him|them)\b", re.IGNORECASE)
+_POSSESSIVE_PRONOUNS = frozenset(("his", "her", "their"))
+_IT_RE = re.compile(r"\bit\b", re.IGNORECASE)
+_CAPITALIZED_WORD = re.compile(r"\b[A-Z][a-zA-Z]+")
 
 # -------------------------------
 # Config
 # -------------------------------
 REGION = "us-east-1"
 BEDROCK_MODEL = "amazon.titan-embed-text-v1"
+EMBEDDING_DIM = 1536                        # Titan Text Embeddings v1 output size
 LLM_MODEL = "amazon.nova-pro-v1:0"
 S3_INPUT_BUCKET = "meddoc-processed"        # input (your JSONs)
 S3_VECTOR_BUCKET = "meddoc-vectorstore"     # output (store FAISS index + metadata)
@@ -31,13 +53,27 @@ LOCAL_FAISS_DIR = os.path.join(BASE_DIR, "faiss")
 os.makedirs(LOCAL_FAISS_DIR, exist_ok=True)
 INDEX_FILE = os.path.join(LOCAL_FAISS_DIR, "index.faiss")
 META_FILE = os.path.join(LOCAL_FAISS_DIR, "metadata.json")
+EMB_FILE = os.path.join(LOCAL_FAISS_DIR, "embeddings.npy")  # normalized chunk vectors, one row per metadata row
+
+# Max concurrent Bedrock requests per process (thread pool + HTTP connection pool)
+BEDROCK_MAX_CONCURRENCY = int(os.getenv("BEDROCK_MAX_CONCURRENCY", "16"))
 
 # -------------------------------
 # Clients
 # -------------------------------
 s3 = boto3.client("s3", region_name=REGION)
 s3_sign = boto3.client("s3", region_name=SOURCE_REGION)
-bedrock = boto3.client("bedrock-runtime", region_name=REGION)
+# botocore keeps only 10 pooled connections by default, which caps fan-out
+bedrock = boto3.client(
+    "bedrock-runtime",
+    region_name=REGION,
+    config=Config(max_pool_connections=BEDROCK_MAX_CONCURRENCY),
+)
+# Shared pool for independent Bedrock calls issued within one request
+_executor = ThreadPoolExecutor(max_workers=BEDROCK_MAX_CONCURRENCY)
+# Separate pool for batch embedding, so a task on _executor can embed without
+# waiting on its own pool
+_embed_executor = ThreadPoolExecutor(max_workers=8)
 # -------------------------------
 # Chat Memory + Patient Tracking
 # -------------------------------
@@ -63,6 +99,58 @@ def reset_memory(session_id: str):
 # -------------------------------
 # Utils
 # -------------------------------        
+class _LRUCache:
+    """Thread-safe map that evicts its least recently used entry beyond `maxsize`.
+
+    Entries can also expire `ttl` seconds after they are stored (for the whole
+    cache, or per entry through put(..., ttl=...)); expired entries are dropped
+    when they are next accessed. A `maxsize` of 0 or less disables the cache.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[object, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[1] is not None and time.monotonic() >= item[1]:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def items(self) -> list:
+        """Snapshot of the live (key, value) pairs, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (_, exp) in self._data.items() if exp is not None and now >= exp]:
+                del self._data[key]
+            return [(key, value) for key, (value, _) in self._data.items()]
+
+_AMZN_RE = re.compile(r"\.amazonaws\.com/(.+)$")
+
+@functools.lru_cache(maxsize=2048)
 def normalize_s3_key(raw: str) -> Optional[str]:
     """Return a clean S3 key like 'patients/Patient Data 15.pdf' from various inputs."""
     if not raw:
@@ -77,7 +165,7 @@ def normalize_s3_key(raw: str) -> Optional[str]:
 
     # 2) If https URL to S3 website/virtual-hosted style, strip origin
     if key.startswith("https://"):
-        m = re.search(r"\.amazonaws\.com/(.+)$", key)
+        m = _AMZN_RE.search(key)
         if m:
             key = m.group(1)
 
@@ -92,25 +180,54 @@ def build_public_url(key: str) -> str:
     base = f"https://{SOURCE_BUCKET}.s3.{SOURCE_REGION}.amazonaws.com"
     return f"{base}/{quote(key, safe='/')}"  # keep "/" but encode spaces etc.
 
+_PRESIGNED_CACHE = _LRUCache(2048)  # {(bucket, key, ttl_sec): url}
+
 def build_presigned_get(key: str, ttl_sec: int = 600) -> str:
-    return s3_sign.generate_presigned_url(
+    """Presigned GET URL; a signed URL is reused while at least half its lifetime remains."""
+    cache_key = (SOURCE_BUCKET, key, ttl_sec)
+    cached = _PRESIGNED_CACHE.get(cache_key)
+    if cached:
+        return cached
+
+    url = s3_sign.generate_presigned_url(
         "get_object",
         Params={"Bucket": SOURCE_BUCKET, "Key": key},
         ExpiresIn=ttl_sec,
     )
+    _PRESIGNED_CACHE.put(cache_key, url, ttl=ttl_sec / 2)
+    return url
 
 # -------------------------------
 # Get embedding from Bedrock
 # -------------------------------
+# Titan embeddings are deterministic, so repeated texts (follow-ups, clicked
+# suggestions) are served from an LRU keyed by the text's sha256; values are
+# the raw float32 bytes of the normalized vector.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+_EMBEDDING_CACHE = _LRUCache(EMBEDDING_CACHE_SIZE)  # {sha256: float32 bytes}
+
 def get_embedding(text: str) -> np.ndarray:
+    cache_key = hashlib.sha256(text.encode("utf-8")).digest()
+    cached = _EMBEDDING_CACHE.get(cache_key)
+    if cached is not None:
+        return np.frombuffer(cached, dtype=np.float32).copy()
+
+    vec = _fetch_embedding(text)
+    _EMBEDDING_CACHE.put(cache_key, vec.tobytes())
+    return vec
+
+def _fetch_embedding(text: str) -> np.ndarray:
     for attempt in range(5):
         try:
             response = bedrock.invoke_model(
                 modelId=BEDROCK_MODEL,
-                body=json.dumps({"inputText": text})
+                body=orjson.dumps({"inputText": text})
             )
-            resp_body = json.loads(response["body"].read())
-            return np.array(resp_body["embedding"], dtype="float32")
+            resp_body = orjson.loads(response["body"].read())
+            vec = np.asarray(resp_body["embedding"], dtype=np.float32).reshape(1, -1)
+            # Same normalization embedding.py applies to the indexed vectors (cosine via inner product)
+            faiss.normalize_L2(vec)
+            return vec[0]
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == 'ThrottlingException':
                 print("Throttled by Bedrock, retrying...")
@@ -119,42 +236,293 @@ def get_embedding(text: str) -> np.ndarray:
                 raise
     raise Exception("Failed to get embedding after retries")
 
+def get_embeddings_batch(texts: List[str]) -> np.ndarray:
+    """Embed many texts with concurrent Bedrock calls; row i is the embedding of texts[i].
+
+    Titan has no batch endpoint, so this overlaps the per-call round trips.
+    Each call keeps get_embedding's own throttling backoff.
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    return np.vstack(list(_embed_executor.map(get_embedding, texts)))
+
 
 # -------------------------------
-# Query FAISS (local only)
+# FAISS index + metadata (loaded once per file version)
 # -------------------------------
-def query_faiss(question, k=3):
-    # Load local FAISS index + metadata
-    if not os.path.exists(INDEX_FILE) or not os.path.exists(META_FILE):
-        raise FileNotFoundError("FAISS index or metadata not found locally. Please build the index first.")
+# Both files are loaded once and kept for the life of the process; they are
+# re-read together (so index ids always line up with metadata rows) only when
+# either file changes on disk, e.g. after /process indexes a new document.
+#
+# The index is memory-mapped so worker processes share its pages and skip the
+# full read on cold start. That takes IO_FLAG_MMAP_IFC: plain IO_FLAG_MMAP only
+# maps IVF inverted lists and still copies Flat/HNSW storage into RAM. Files
+# that cannot be mapped are read normally, and a legacy L2 index is copied
+# into RAM anyway when to_cosine_index converts it. metadata.json is pivoted into parallel columns so the hot loops
+# walk flat lists instead of doing a dict lookup per chunk; rows are rebuilt
+# as dicts only for the chunks that are actually returned.
+_INDEX = None
+_INDEX_MTIMES: Optional[tuple] = None
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))  # HNSW search breadth
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))        # IVF lists probed per query
+_INDEX_LOCK = threading.Lock()
+faiss.omp_set_num_threads(int(os.getenv("FAISS_OMP_THREADS", os.cpu_count() or 1)))
+
+_META_TEXT: List[str] = []
+_META_TEXT_LOWER: List[str] = []
+_META_SOURCE: List[Optional[str]] = []
+_META_FILE: List[Optional[str]] = []
+_META_CHUNK_ID: List = []
+_META_TYPE: List[Optional[str]] = []
+_META_PAGE = np.zeros(0, dtype=np.int32)  # 0 = no page
+_META_PATIENT: List[Optional[str]] = []  # patient whose report the chunk belongs to, if any
+_META_S3_KEY: List[Optional[str]] = []  # normalized S3 key of the chunk's source document
+_PATIENT_ROWS: Dict[str, frozenset] = {}  # lowercased patient name -> rows of their reports
+_META_POSTINGS: Dict[str, List[int]] = {}  # alphanumeric token -> rows containing it (ascending)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_META_EMB: Optional[np.ndarray] = None  # (N, EMBEDDING_DIM) float32, row i = metadata row i
+
+# Patient names come from the "Full name of patient" field of the indexed
+# medical reports. They fill _META_PATIENT for every chunk of the report, and
+# the gazetteer below matches a known patient in a question without spaCy.
+_PATIENT_NAME_FIELD = re.compile(r"Full name of patient\s+(.+?)\s+NRIC")
+_PATIENT_NAMES: Dict[str, str] = {}           # lowercased name -> name as written in the report
+_PATIENT_NAME_RE: Optional[re.Pattern] = None
+
+def _read_index():
     print("Reading FAISS index from:", os.path.abspath(INDEX_FILE))
+    try:
+        index = faiss.read_index(INDEX_FILE, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(INDEX_FILE)
+    if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        # Index built before vectors were normalized; convert in memory until it is rebuilt
+        index = to_cosine_index(index)
+
+    # Search-time knobs for approximate index types (see FAISS_INDEX_SPEC in embedding.py)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = FAISS_EF_SEARCH
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = FAISS_NPROBE
+    return index
+
+def _read_metadata():
+    """Load metadata.json into the column globals."""
+    global _META_TEXT, _META_TEXT_LOWER, _META_SOURCE, _META_FILE, _META_CHUNK_ID, _META_TYPE, _META_PAGE, _META_PATIENT, _PATIENT_ROWS, _META_S3_KEY
     print("Reading metadata from:", os.path.abspath(META_FILE))
-    index = faiss.read_index(INDEX_FILE)
-    with open(META_FILE, "r") as f:
-        metadata = json.load(f)
+    with open(META_FILE, "rb") as f:
+        metadata = orjson.loads(f.read())
+
+    _META_TEXT = [m["text"] for m in metadata]
+    _META_TEXT_LOWER = [t.lower() for t in _META_TEXT]
+    _META_SOURCE = [m.get("source") for m in metadata]
+    _META_FILE = [m.get("file") for m in metadata]
+    _META_CHUNK_ID = [m.get("chunk_id") for m in metadata]
+    _META_TYPE = [m.get("type") for m in metadata]
+    _META_PAGE = np.array([m.get("page") or 0 for m in metadata], dtype=np.int32)
+    _META_S3_KEY = [normalize_s3_key(s or f or "") for s, f in zip(_META_SOURCE, _META_FILE)]
+
+    # A report names its patient once (in its first chunk); tag all of its chunks
+    file_patient = {}
+    for f, t in zip(_META_FILE, _META_TEXT):
+        m = _PATIENT_NAME_FIELD.search(t)
+        if m:
+            file_patient.setdefault(f, m.group(1).strip())
+    _META_PATIENT = [file_patient.get(f) for f in _META_FILE]
+    patient_rows = defaultdict(set)
+    for idx, name in enumerate(_META_PATIENT):
+        if name:
+            patient_rows[name.lower()].add(idx)
+    _PATIENT_ROWS = {name: frozenset(rows) for name, rows in patient_rows.items()}
+    _build_patient_gazetteer()
+    _build_postings()
+
+def _build_postings():
+    """Inverted index over the lowered chunk texts, used to prefilter keyword_search."""
+    global _META_POSTINGS
+    postings = defaultdict(list)
+    for idx, text_lower in enumerate(_META_TEXT_LOWER):
+        for tok in set(_TOKEN_RE.findall(text_lower)):
+            postings[tok].append(idx)
+    _META_POSTINGS = dict(postings)
+    _candidate_rows.cache_clear()
+
+@functools.lru_cache(maxsize=1024)
+def _candidate_rows(needle: str) -> Optional[frozenset]:
+    """Rows that can contain `needle` as a substring, or None if any row can.
+
+    Every alphanumeric run of the needle lies inside one token of a matching
+    chunk, so the rows of the vocabulary tokens containing its longest run are
+    a superset of the real matches.
+    """
+    runs = _TOKEN_RE.findall(needle)
+    if not runs:
+        return None
+    probe = max(runs, key=len)
+    rows = set()
+    for tok, ids in _META_POSTINGS.items():
+        if probe in tok:
+            rows.update(ids)
+    return frozenset(rows)
+
+def _build_patient_gazetteer():
+    global _PATIENT_NAMES, _PATIENT_NAME_RE
+    names = {}
+    for name in _META_PATIENT:
+        if name:
+            names.setdefault(name.lower(), name)
+    _PATIENT_NAMES = names
+    if names:
+        # Longest first so "Tan Wei Ling" wins over a shorter name it contains.
+        # An optional trailing possessive also matches "Raj Kumars", which is
+        # what remove_emojis() leaves of "Raj Kumar's".
+        alternation = "|".join(map(re.escape, sorted(names, key=len, reverse=True)))
+        _PATIENT_NAME_RE = re.compile(r"\b(" + alternation + r")(?:'?s)?\b", re.IGNORECASE)
+    else:
+        _PATIENT_NAME_RE = None
+    print(f"Patient name gazetteer: {len(names)} names")
 
-    # Embed query and search
-    query_vec = get_embedding(question).reshape(1, -1)
-    D, I = index.search(query_vec, k)
+def _read_embeddings(index):
+    """Load the chunk vectors aligned to the metadata rows into _META_EMB.
 
-    results = []
-    for idx in I[0]:
-        if idx == -1 or idx >= len(metadata):
-            continue
-        results.append(metadata[idx])
+    embeddings.npy is memory-mapped; without it (indexes built before it was
+    written) the vectors are reconstructed from the index where its type allows.
+    """
+    global _META_EMB
+    emb = None
+    if os.path.exists(EMB_FILE):
+        emb = np.load(EMB_FILE, mmap_mode="r")
+    else:
+        try:
+            emb = index.reconstruct_n(0, index.ntotal)
+        except RuntimeError as e:
+            print(f"Chunk vectors unavailable for re-ranking: {e}")
+    if emb is not None and emb.shape[0] != len(_META_TEXT):
+        print(f"Ignoring chunk vectors: {emb.shape[0]} rows for {len(_META_TEXT)} metadata rows")
+        emb = None
+    _META_EMB = emb
+
+def _load_index():
+    """Return the FAISS index, (re)loading it, the metadata columns and the chunk vectors if any file changed."""
+    global _INDEX, _INDEX_MTIMES
+    if not os.path.exists(INDEX_FILE) or not os.path.exists(META_FILE):
+        raise FileNotFoundError("FAISS index or metadata not found locally. Please build the index first.")
+    mtimes = (
+        os.path.getmtime(INDEX_FILE),
+        os.path.getmtime(META_FILE),
+        os.path.getmtime(EMB_FILE) if os.path.exists(EMB_FILE) else None,
+    )
+    if _INDEX is not None and mtimes == _INDEX_MTIMES:
+        return _INDEX
+
+    with _INDEX_LOCK:
+        if _INDEX is None or mtimes != _INDEX_MTIMES:  # another thread may have loaded it meanwhile
+            index = _read_index()
+            _read_metadata()
+            _read_embeddings(index)
+            _INDEX, _INDEX_MTIMES = index, mtimes
+    return _INDEX
+
+def _meta_row(idx: int) -> Dict:
+    """Materialize metadata chunk `idx` as the dict shape callers expect."""
+    return {
+        "file": _META_FILE[idx],
+        "chunk_id": _META_CHUNK_ID[idx],
+        "text": _META_TEXT[idx],
+        "page": int(_META_PAGE[idx]) or None,
+        "source": _META_SOURCE[idx],
+        "type": _META_TYPE[idx],
+        "patient": _META_PATIENT[idx],
+        "_src": _META_S3_KEY[idx],
+        "_idx": idx,
+    }
+
+def _chunk_text_lower(chunk: Dict) -> str:
+    """Lowercased text of a search hit, served from the precomputed column when possible."""
+    idx = chunk.get("_idx")
+    if idx is not None and idx < len(_META_TEXT_LOWER):
+        return _META_TEXT_LOWER[idx]
+    return chunk["text"].lower()
+
+def _chunk_is_about(chunk: Dict, patient_name_lower: str) -> bool:
+    """True if a search hit belongs to the patient's reports or mentions the patient."""
+    patient = chunk.get("patient")
+    return (patient is not None and patient.lower() == patient_name_lower) or patient_name_lower in _chunk_text_lower(chunk)
 
-    return results
+# -------------------------------
+# Query FAISS (local only)
+# -------------------------------
+def _faiss_search_ids(question, k=3, rows=None) -> List[int]:
+    """Metadata row indices of the `k` chunks nearest to `question`.
+
+    `rows` restricts the search to those metadata rows (e.g. one patient's
+    reports). Such a bucket is small, so it is ranked exactly against the
+    stored chunk vectors; without them the index is searched with an ID selector.
+    """
+    # Cached local FAISS index + metadata
+    index = _load_index()
+
+    # Embed query and search
+    # faiss takes C-contiguous float32 rows without copying
+    query_vec = np.ascontiguousarray(get_embedding(question)[None, :], dtype=np.float32)
+    if rows is None:
+        D, I = index.search(query_vec, k)
+        return [int(idx) for idx in I[0] if 0 <= idx < len(_META_TEXT)]
+
+    rows = np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+    if _META_EMB is not None:
+        sims = _META_EMB[rows] @ query_vec[0]
+        return [int(idx) for idx in rows[np.argsort(-sims, kind="stable")[:k]]]
+    D, I = index.search(query_vec, k, params=_selector_params(index, rows))
+    return [int(idx) for idx in I[0] if 0 <= idx < len(_META_TEXT)]
+
+def _selector_params(index, rows):
+    """Search parameters limiting `index` to `rows`, keeping the configured search breadth."""
+    sel = faiss.IDSelectorBatch(rows)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=FAISS_EF_SEARCH)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=FAISS_NPROBE)
+    return faiss.SearchParameters(sel=sel)
+
+def query_faiss(question, k=3):
+    return [_meta_row(idx) for idx in _faiss_search_ids(question, k)]
 
 # -------------------------------
 # Keyword + Hybrid Search
 # -------------------------------
 
-nlp = spacy.load("en_core_web_sm")
+# The dependency parser is never used, so it is not loaded at all. Each call
+# site additionally skips the components whose output it does not read.
+nlp = spacy.load("en_core_web_sm", exclude=["parser"])
+NLP_ENTS_AND_POS = ["lemmatizer"]           # doc.ents + token.pos_
+NLP_POS_AND_LEMMA = ["ner"]                 # token.pos_ + token.lemma_
+NLP_POS_ONLY = ["ner", "lemmatizer"]        # token.pos_
+
+def _has_name_candidate(query: str) -> bool:
+    """True if the query has a capitalized word that is not a stop word (e.g. "What")."""
+    return any(w.lower() not in nlp.Defaults.stop_words for w in _CAPITALIZED_WORD.findall(query))
 
-def extract_patient_names(query):
-    """Extract patient names using NLP entity recognition with fallback."""
-    query=remove_emojis(query)
-    doc = nlp(query)
+def extract_patient_names(query, doc=None):
+    """Extract patient names, trying the report gazetteer before spaCy.
+
+    Known patients are matched with one regex over the query. spaCy NER (with
+    a proper-noun fallback) runs only when that finds nothing and the query
+    has a capitalized non-stop word that could be an unknown name. Pass `doc`
+    (a parse of the emoji-free query) to reuse an existing parse.
+    """
+    if _PATIENT_NAME_RE is not None:
+        found = _PATIENT_NAME_RE.findall(query)
+        if found:
+            names = list(dict.fromkeys(_PATIENT_NAMES[n.lower()] for n in found))
+            print("Patient names detected:", names)
+            return names
+    if doc is None:
+        query = remove_emojis(query)
+        if not _has_name_candidate(query):
+            print("Patient names detected:", [])
+            return []
+        doc = nlp(query, disable=NLP_ENTS_AND_POS)
     names = []
     
     # First, use NLP's PERSON entity recognition
@@ -174,28 +542,37 @@ def extract_patient_names(query):
         if 1 <= len(proper_nouns) <= 3:
             names.append(" ".join(proper_nouns))
     
-    # Remove duplicates while preserving order
+    # Remove duplicates (case-insensitively) while preserving order
     unique_names = []
+    seen = set()
     for name in names:
-        if name.lower() not in [n.lower() for n in unique_names]:
+        if name.lower() not in seen:
+            seen.add(name.lower())
             unique_names.append(name)
     
     print("Patient names detected:", unique_names)
     return unique_names
 
-def extract_keywords(query):
-    """Extract general keywords for search using NLP."""
-    doc = nlp(query)
+def extract_keywords(query, doc=None, patient_names=None):
+    """Extract general keywords for search using NLP.
+
+    Pass `doc` to reuse an existing parse of `query`, and `patient_names` if
+    they were already extracted from it.
+    """
+    if doc is None:
+        doc = nlp(query, disable=NLP_ENTS_AND_POS)
     keywords = []
     
-    # Extract patient names
-    patient_names = extract_patient_names(query)
+    # Extract patient names (from the same parse)
+    if patient_names is None:
+        patient_names = extract_patient_names(query, doc=doc)
     keywords.extend(patient_names)
+    name_words = {name.lower() for name in patient_names}
     
     # Extract meaningful words using NLP (nouns, proper nouns, adjectives)
     for token in doc:
         if (not token.is_stop and not token.is_punct and len(token.text) > 2 and 
-            token.pos_ in ['NOUN', 'PROPN', 'ADJ'] and token.text.lower() not in [name.lower() for name in patient_names]):
+            token.pos_ in ['NOUN', 'PROPN', 'ADJ'] and token.text.lower() not in name_words):
             keywords.append(token.text)
     
     # Extract named entities
@@ -206,25 +583,65 @@ def extract_keywords(query):
     print("Keywords detected:", keywords)
     return keywords
 
-def keyword_search(query, max_hits=5):
-    with open(META_FILE, "r") as f:
-        metadata = json.load(f)
+def _keyword_search_ids(keywords, max_hits=5) -> List[int]:
+    """Metadata row indices of chunks containing any of `keywords` (substring match).
+
+    The inverted index narrows the scan to chunks that can contain a keyword;
+    only those are matched. Each keyword still contributes at most `max_hits`
+    chunks; the scan stops as soon as every keyword has used up its quota.
+    """
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    needles = list(dict.fromkeys(k.lower() for k in keywords if k.strip()))
+    if not needles:
+        return []
+    _load_index()
+
+    # Aho-Corasick automaton: one pass per chunk reports every keyword it
+    # contains, including overlapping ones ("ali" inside "ali bin hassan")
+    automaton = ahocorasick.Automaton()
+    for n in needles:
+        automaton.add_word(n, n)
+    automaton.make_automaton()
+
+    candidates = set()
+    for n in needles:
+        rows = _candidate_rows(n)
+        if rows is None:  # no alphanumerics to look up: scan everything
+            candidates = range(len(_META_TEXT_LOWER))
+            break
+        candidates |= rows
+    if isinstance(candidates, set):
+        candidates = sorted(candidates)  # corpus order, as in a full scan
+
+    quota = dict.fromkeys(needles, max_hits)
+    remaining = max_hits * len(needles)
     results = []
-    for idx, chunk in enumerate(metadata):
-        if query.lower() in chunk["text"].lower():
-            results.append(chunk)
-            if len(results) >= max_hits:
-                break
+    for idx in candidates:
+        text_lower = _META_TEXT_LOWER[idx]
+        matched = [n for n in {n for _, n in automaton.iter(text_lower)} if quota[n] > 0]
+        if not matched:
+            continue
+        results.append(idx)
+        for n in matched:
+            quota[n] -= 1
+        remaining -= len(matched)
+        if remaining <= 0:
+            break
     return results
 
+def keyword_search(keywords, max_hits=5):
+    return [_meta_row(idx) for idx in _keyword_search_ids(keywords, max_hits)]
+
 def hybrid_search(query, session_id="default", top_k=None, keyword_hits=10):
     """Dynamic search with patient context awareness."""
     # Clear patient context for general medical questions FIRST
     query = remove_emojis(query)
-    original_patient_names = extract_patient_names(query)
-    pronouns = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them']
-    query_words = query.lower().split()
-    has_pronouns = any(pronoun in query_words for pronoun in pronouns)
+    _load_index()  # fresh metadata and patient-name gazetteer before name detection
+    # Parse once; the Doc is shared by name and keyword extraction
+    doc = nlp(query, disable=NLP_ENTS_AND_POS)
+    original_patient_names = extract_patient_names(query, doc=doc)
+    has_pronouns = bool(_PRONOUN_DETECT.search(query))
     
     print(f"DEBUG CLEAR: names={original_patient_names}, pronouns={has_pronouns}, session_in_patient={session_id in current_patient}")
     
@@ -233,63 +650,51 @@ def hybrid_search(query, session_id="default", top_k=None, keyword_hits=10):
         del current_patient[session_id]
     
     # Update patient context and resolve pronouns
-    processed_query = update_patient_context(query, session_id)
+    processed_query = update_patient_context(query, session_id, patient_names=original_patient_names)
     
     # Dynamically set top_k if not provided
     if top_k is None:
         top_k = 15 if len(processed_query.split()) <= 3 else 10
 
+    # Patient-specific query (names/pronouns from the original query, not processed):
+    # search only the current patient's reports when we have them indexed
+    patient_specific = bool(original_patient_names or has_pronouns)
+    current_patient_name = get_patient_context(session_id) if patient_specific else None
+    patient_rows = _PATIENT_ROWS.get(current_patient_name.lower()) if current_patient_name else None
+
     # Use processed query for FAISS search
-    faiss_results = query_faiss(processed_query, k=top_k)
+    faiss_ids = _faiss_search_ids(processed_query, k=top_k, rows=patient_rows)
     
     # Extract keywords from processed query
-    keywords = extract_keywords(processed_query)
-    keyword_results = []
-    for keyword in keywords:
-        keyword_results.extend(keyword_search(keyword, max_hits=keyword_hits))
-
-    # Merge results using text-based deduplication
-    seen_texts = set()
-    merged = []
-    
-    # Add FAISS results first
-    for r in faiss_results:
-        text_key = r["text"][:100].lower()  # Use first 100 chars as key
-        if text_key not in seen_texts:
-            seen_texts.add(text_key)
-            merged.append(r)
-    
-    # Add keyword results
-    for r in keyword_results:
-        text_key = r["text"][:100].lower()
-        if text_key not in seen_texts:
-            seen_texts.add(text_key)
-            merged.append(r)
-
-    # Filter by current patient ONLY if the query is patient-specific
-    original_patient_names = extract_patient_names(query)  # Check original query, not processed
-    pronouns = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them']
-    has_pronouns = any(pronoun in query.lower() for pronoun in pronouns)
-    
-    # Only filter by patient if the query explicitly mentions patients or uses pronouns
-    if original_patient_names or has_pronouns:
-        current_patient_name = get_patient_context(session_id)
-        if current_patient_name:
-            patient_filtered = []
-            
-            for result in merged:
-                if current_patient_name.lower() in result["text"].lower():
-                    patient_filtered.append(result)
-            
-            # If we have patient-specific results, use only those
-            if patient_filtered:
-                merged = patient_filtered
-                print(f"🔹 Using only {len(patient_filtered)} patient-specific results for {current_patient_name}")
-            else:
-                # If no patient-specific results found, return empty list to indicate no data
-                print(f"🔹 No records found for {current_patient_name}")
-                merged = []
+    # (the query's Doc and names are reused unless pronoun resolution changed the text)
+    if processed_query == query:
+        keywords = extract_keywords(query, doc=doc, patient_names=original_patient_names)
+    else:
+        keywords = extract_keywords(processed_query)
+    keyword_ids = _keyword_search_ids(keywords, max_hits=keyword_hits)
+
+    # Merge results (FAISS first, then keyword), deduplicating on the row index:
+    # embedding.py never stores a (file, chunk_id) twice, so a row is a chunk
+    merged_ids = list(dict.fromkeys(faiss_ids + keyword_ids))
+
+    # Filter by current patient ONLY if the query is patient-specific: keep
+    # chunks of the patient's reports and any other chunk that names them
+    if current_patient_name:
+        patient_name_lower = current_patient_name.lower()
+        bucket = patient_rows or frozenset()
+        patient_filtered = [i for i in merged_ids if i in bucket or patient_name_lower in _META_TEXT_LOWER[i]]
+        
+        # If we have patient-specific results, use only those
+        if patient_filtered:
+            merged_ids = patient_filtered
+            print(f"🔹 Using only {len(patient_filtered)} patient-specific results for {current_patient_name}")
+        else:
+            # If no patient-specific results found, return empty list to indicate no data
+            print(f"🔹 No records found for {current_patient_name}")
+            merged_ids = []
 
+    # Rows are only materialized for the chunks that survive dedup and filtering
+    merged = [_meta_row(i) for i in merged_ids]
     print(f"Total merged results: {len(merged)}")
     print(f"Current patient context: {get_patient_context(session_id)}")
     return merged, processed_query
@@ -312,97 +717,156 @@ Answer:"""
 
     response = bedrock.invoke_model(
         modelId=LLM_MODEL,
-        body=json.dumps({
+        body=orjson.dumps({
             "messages": [{"role": "user", "content": [{"text": prompt}]}],
             "inferenceConfig": {"maxTokens": 512, "temperature": 0.2, "topP": 0.9}
         })
     )
-    resp_body = json.loads(response["body"].read())
+    resp_body = orjson.loads(response["body"].read())
     return resp_body["output"]["message"]["content"][0]["text"]
 
-def extract_highlight(question, chunk_text):
-    """Ask LLM to return the most relevant sentence(s) from chunk."""
-    prompt = f"""
-    Extract the most relevant sentence(s) from the following text that directly answer the question. 
-    If nothing relevant, return 'N/A'.
-
-    Question: {question}
-    Text: {chunk_text}
-    """
-    response = bedrock.invoke_model(
+def stream_llm_text(prompt, inference_config):
+    """Yield text deltas from Nova Pro as they are generated."""
+    response = bedrock.invoke_model_with_response_stream(
         modelId=LLM_MODEL,
-        body=json.dumps({
+        body=orjson.dumps({
             "messages": [{"role": "user", "content": [{"text": prompt}]}],
-            "inferenceConfig": {"maxTokens": 64, "temperature": 0.0}
+            "inferenceConfig": inference_config
         })
     )
-    resp_body = json.loads(response["body"].read())
-    highlight = resp_body["output"]["message"]["content"][0]["text"]
-    print("Extracted highlight:", highlight)
-    return highlight.strip()
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        delta = orjson.loads(chunk["bytes"]).get("contentBlockDelta", {}).get("delta", {})
+        if delta.get("text"):
+            yield delta["text"]
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+HIGHLIGHT_MIN_SIMILARITY = float(os.getenv("HIGHLIGHT_MIN_SIMILARITY", "0.35"))
+
+# The same top chunks recur across related questions; highlights are cached by
+# (question, chunk text) digests so a repeat skips sentence splitting and scoring.
+HIGHLIGHT_CACHE_SIZE = int(os.getenv("HIGHLIGHT_CACHE_SIZE", "4096"))
+_HIGHLIGHT_CACHE = _LRUCache(HIGHLIGHT_CACHE_SIZE)  # {(question digest, chunk digest): highlight}
+
+def extract_highlight(question, chunk_text):
+    """Return the sentence of the chunk closest to the question, or 'N/A' if none is relevant."""
+    return extract_highlights_batch(question, [chunk_text])[0]
+
+def extract_highlights_batch(question, chunk_texts: List[str]) -> List[str]:
+    """Highlight of each chunk (see extract_highlight), aligned to `chunk_texts`.
+
+    Sentences are ranked by cosine similarity between their embeddings and the
+    (cached) question embedding, so no LLM call is needed. The sentences of
+    all uncached chunks are embedded in one get_embeddings_batch call.
+    """
+    question_digest = hashlib.blake2b(question.encode("utf-8")).digest()
+    cache_keys = [(question_digest, hashlib.blake2b(t.encode("utf-8")).digest()) for t in chunk_texts]
+    results: List[Optional[str]] = [_HIGHLIGHT_CACHE.get(cache_key) for cache_key in cache_keys]
+
+    # Split every uncached chunk; spans[i] is its slice of the flat sentence list
+    sentences, spans = [], {}
+    for i, text in enumerate(chunk_texts):
+        if results[i] is None:
+            chunk_sentences = [s for s in map(str.strip, _SENTENCE_SPLIT.split(text)) if len(s) > 2]
+            spans[i] = (len(sentences), len(sentences) + len(chunk_sentences))
+            sentences.extend(chunk_sentences)
+    if not spans:
+        return results
+
+    sims = get_embeddings_batch(sentences) @ get_embedding(question) if sentences else np.empty(0)
+    for i, (lo, hi) in spans.items():
+        highlight = "N/A"
+        if hi > lo:
+            best = lo + int(np.argmax(sims[lo:hi]))
+            if sims[best] >= HIGHLIGHT_MIN_SIMILARITY:
+                highlight = sentences[best]
+                print("Extracted highlight:", highlight)
+        results[i] = highlight
+
+    for i in spans:
+        _HIGHLIGHT_CACHE.put(cache_keys[i], results[i])
+    return results
+
+_TOPIC_LEMMAS = _LRUCache(1024)  # {text: its topic lemmas}
+
+def _topic_lemmas(texts: List[str]) -> List[frozenset]:
+    """Lemmas of the meaningful words (nouns, adjectives, proper nouns) of each text.
+
+    A chat message is compared on several consecutive turns, so results are
+    cached per text; only unseen texts are parsed, in one nlp.pipe batch.
+    """
+    found = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        cached = _TOPIC_LEMMAS.get(text)
+        if cached is None:
+            missing.append(text)
+        else:
+            found[text] = cached
+    for text, doc in zip(missing, nlp.pipe(missing, batch_size=8, disable=NLP_POS_AND_LEMMA)):
+        found[text] = frozenset(
+            token.lemma_ for token in doc
+            if (not token.is_stop and not token.is_punct and len(token.text) > 3 and
+                token.pos_ in ['NOUN', 'ADJ', 'PROPN'])
+        )
+        _TOPIC_LEMMAS.put(text, found[text])
+    return [found[t] for t in texts]
 
 def is_related_to_previous_context(current_question: str, session_id: str) -> bool:
     """Check if current question is related to previous conversation."""
     if session_id not in chat_memory or len(chat_memory[session_id]) == 0:
         return False
     
+    # Check patient indicators first: a pronoun or "patient" reference always
+    # counts as related, so the spaCy comparison below can be skipped
+    if _PATIENT_INDICATOR_DETECT.search(current_question):
+        print("Context relation check: patient_indicators=True - Related")
+        return True
+    
     # Get last few exchanges
     recent_history = chat_memory[session_id][-4:]  # Last 2 Q&A pairs
-    history_text = " ".join([msg["content"] for msg in recent_history]).lower()
-    
-    # Extract keywords from current question and history
-    current_doc = nlp(current_question.lower())
-    history_doc = nlp(history_text)
-    
-    # Get meaningful words (nouns, adjectives, medical terms)
-    current_keywords = set()
-    for token in current_doc:
-        if (not token.is_stop and not token.is_punct and len(token.text) > 3 and 
-            token.pos_ in ['NOUN', 'ADJ', 'PROPN']):
-            current_keywords.add(token.lemma_)
-    
-    history_keywords = set()
-    for token in history_doc:
-        if (not token.is_stop and not token.is_punct and len(token.text) > 3 and 
-            token.pos_ in ['NOUN', 'ADJ', 'PROPN']):
-            history_keywords.add(token.lemma_)
-    
-    # Check patient indicators first
-    patient_indicators = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them', 'patient', 'it', 'this', 'that','its']
-    question_words = current_question.lower().split()
-    has_patient_indicators = any(indicator in question_words for indicator in patient_indicators)
-    
-    # If no keywords found, rely on patient indicators
+    
+    # Extract keywords (meaningful words) from current question and each history message
+    current_keywords, *history_sets = _topic_lemmas(
+        [current_question.lower()] + [msg["content"].lower() for msg in recent_history]
+    )
+    history_keywords = frozenset().union(*history_sets)
+    
+    # If no keywords found there is nothing to compare (and no patient indicators)
     if len(current_keywords) == 0 or len(history_keywords) == 0:
-        is_related = has_patient_indicators
+        is_related = False
         overlap_ratio = 0.0
     else:
-        # Check overlap when keywords are available
+        # Consider related if there's significant keyword overlap
         overlap = len(current_keywords & history_keywords)
         overlap_ratio = overlap / min(len(current_keywords), len(history_keywords))
-        # Consider related if there's significant overlap OR if it has patient indicators (like pronouns)
-        is_related = overlap_ratio > 0.3 or has_patient_indicators
-    print(f"Context relation check: {overlap_ratio:.2f} overlap, patient_indicators={has_patient_indicators} - {'Related' if is_related else 'Unrelated'}")
+        is_related = overlap_ratio > 0.3
+    print(f"Context relation check: {overlap_ratio:.2f} overlap, patient_indicators=False - {'Related' if is_related else 'Unrelated'}")
     
     return is_related
 
-def update_patient_context(question: str, session_id: str) -> str:
-    """Update patient context and resolve pronouns."""
+def update_patient_context(question: str, session_id: str, patient_names: Optional[List[str]] = None) -> str:
+    """Update patient context and resolve pronouns.
+
+    `patient_names` may be passed when the caller already extracted them from `question`.
+    """
     # Extract patient names from current question
-    patient_names = extract_patient_names(question)
+    if patient_names is None:
+        patient_names = extract_patient_names(question)
+    has_pronouns = bool(_CONTEXT_PRONOUN_DETECT.search(question))
     
-    # Check if current question is related to previous context
-    if not is_related_to_previous_context(question, session_id):
+    # Check if current question is related to previous context. Computed once:
+    # clearing the history below cannot turn an unrelated question into a related one.
+    is_related = is_related_to_previous_context(question, session_id)
+    if not is_related:
         # Clear chat history for unrelated questions
         if session_id in chat_memory and len(chat_memory[session_id]) > 0:
             print(f"Clearing chat history - unrelated topic detected")
             chat_memory[session_id] = []
         
         # Clear patient context for unrelated questions ONLY if no pronouns in current question
-        pronouns = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them', 'it', 'this', 'that']
-        question_words = question.lower().split()
-        has_pronouns = any(pronoun in question_words for pronoun in pronouns)
-        
         if not has_pronouns and session_id in current_patient:
             print(f"Clearing patient context - unrelated topic")
             del current_patient[session_id]
@@ -413,12 +877,7 @@ def update_patient_context(question: str, session_id: str) -> str:
         print(f"Updated patient context for session {session_id}: {patient_names[0]}")
     elif not patient_names:
         # Check if question has pronouns or patient-specific terms
-        pronouns = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them', 'it', 'this', 'that']
-        patient_terms = ['patient', 'this patient', 'the patient']
-        
-        question_words = question.lower().split()
-        has_pronouns = any(pronoun in question_words for pronoun in pronouns)
-        has_patient_terms = any(term in question.lower() for term in patient_terms)
+        has_patient_terms = bool(_PATIENT_TERM_DETECT.search(question))
         
         # Clear patient context for general medical questions
         if not has_pronouns and not has_patient_terms:
@@ -427,10 +886,7 @@ def update_patient_context(question: str, session_id: str) -> str:
                 del current_patient[session_id]
     
     # Additional check: if question is unrelated AND has no patient names/pronouns, clear patient context
-    if not is_related_to_previous_context(question, session_id):
-        pronouns = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them', 'it', 'this', 'that']
-        question_words = question.lower().split()
-        has_pronouns = any(pronoun in question_words for pronoun in pronouns)
+    if not is_related:
         if not patient_names and not has_pronouns and session_id in current_patient:
             print(f"Force clearing patient context - unrelated general query")
             del current_patient[session_id]
@@ -440,22 +896,13 @@ def update_patient_context(question: str, session_id: str) -> str:
     
     # Resolve pronouns based on context
     if patient:
-        # Patient-specific pronoun resolution
-        pronoun_patterns = [
-            (r"\bhis\b", f"{patient}'s"),
-            (r"\bher\b", f"{patient}'s"),
-            (r"\btheir\b", f"{patient}'s"),
-            (r"\bhe\b", patient),
-            (r"\bshe\b", patient),
-            (r"\bthey\b", patient),
-            (r"\bhim\b", patient),
-            (r"\bthem\b", patient),
-            (r"\bthe patient\b", patient),
-            (r"\bthis patient\b", patient)
-        ]
-        
-        for pattern, replacement in pronoun_patterns:
-            question = re.sub(pattern, replacement, question, flags=re.IGNORECASE)
+        # Patient-specific pronoun resolution: possessives become "<patient>'s",
+        # everything else the bare name
+        possessive = f"{patient}'s"
+        question = _PRONOUN_RESOLVE.sub(
+            lambda m: possessive if m.group(1).lower() in _POSSESSIVE_PRONOUNS else patient,
+            question,
+        )
     
     # Resolve 'it' based on main topic from most recent chat
     if 'it' in question.lower().split():
@@ -469,7 +916,7 @@ def update_patient_context(question: str, session_id: str) -> str:
             
             if last_user_msg:
                 # Extract nouns from the last user message, prioritizing medical conditions
-                doc = nlp(last_user_msg.lower())
+                doc = nlp(last_user_msg.lower(), disable=NLP_POS_ONLY)
                 nouns = []
                 for token in doc:
                     if (token.pos_ in ['NOUN', 'PROPN'] and len(token.text) > 3 and 
@@ -498,7 +945,7 @@ def update_patient_context(question: str, session_id: str) -> str:
                     main_topic = nouns[0]
                 
                 if main_topic:
-                    question = re.sub(r"\bit\b", main_topic, question, flags=re.IGNORECASE)
+                    question = _IT_RE.sub(main_topic, question)
     
     return question
 
@@ -507,8 +954,24 @@ def get_patient_context(session_id: str) -> Optional[str]:
     return current_patient.get(session_id)
 
 
+# Out-of-scope questions repeat a lot; general answers are cached by the
+# normalized question: lowercased, whitespace collapsed and trailing "?!."
+# dropped. Other symbols are kept, since "B+"/"B-" or "> 38C"/"< 38C" change
+# the medical meaning of a question.
+GENERAL_ANSWER_TTL = int(os.getenv("GENERAL_ANSWER_TTL", "3600"))
+_GENERAL_ANSWER_CACHE = _LRUCache(1024, ttl=GENERAL_ANSWER_TTL)  # {digest: answer}
+
+def _general_answer_key(question: str) -> bytes:
+    normalized = " ".join(question.lower().split()).rstrip("?!. ")
+    return hashlib.blake2b(normalized.encode("utf-8")).digest()
+
 def generate_general_medical_answer(question):
     """Generate general medical information when no specific records are found."""
+    cache_key = _general_answer_key(question)
+    cached = _GENERAL_ANSWER_CACHE.get(cache_key)
+    if cached:
+        return cached
+
     prompt = f"""Provide a brief, general medical answer to this question based on common medical knowledge. Keep the response concise and factual.
 
 Question: {question}
@@ -518,27 +981,33 @@ Answer:"""
     try:
         response = bedrock.invoke_model(
             modelId=LLM_MODEL,
-            body=json.dumps({
+            body=orjson.dumps({
                 "messages": [{"role": "user", "content": [{"text": prompt}]}],
                 "inferenceConfig": {"maxTokens": 300, "temperature": 0.3, "topP": 0.8}
             })
         )
-        resp_body = json.loads(response["body"].read())
-        return resp_body["output"]["message"]["content"][0]["text"]
+        resp_body = orjson.loads(response["body"].read())
+        answer = resp_body["output"]["message"]["content"][0]["text"]
+        _GENERAL_ANSWER_CACHE.put(cache_key, answer)
+        return answer
     except Exception as e:
         print(f"Error generating general answer: {e}")
         return "I'm unable to provide information on this topic. Please consult with a healthcare professional."
 
-def generate_query_suggestions(session_id="default", contexts=None):
-    """Generate 4 relevant follow-up questions based on current chat topic."""
-    memory_context = get_memory_context(session_id, max_turns=2)
+def generate_query_suggestions(session_id="default", contexts=None, last_question=None):
+    """Generate 4 relevant follow-up questions based on current chat topic.
+
+    The topic is the last user question in memory; pass `last_question` to
+    use the turn in progress before it has been added to memory.
+    """
+    if last_question is None:
+        memory_context = get_memory_context(session_id, max_turns=2)
     
-    if not memory_context:
-        return ["What are common symptoms?", "How is this treated?", "What causes this condition?", "Are there any complications?"]
+        if not memory_context:
+            return ["What are common symptoms?", "How is this treated?", "What causes this condition?", "Are there any complications?"]
     
-    # Get the last user question to identify the main topic
-    last_question = ""
-    if memory_context:
+        # Get the last user question to identify the main topic
+        last_question = ""
         lines = memory_context.split('\n')
         for line in reversed(lines):
             if line.startswith('User:'):
@@ -548,7 +1017,7 @@ def generate_query_suggestions(session_id="default", contexts=None):
     # Extract main medical topic from the question
     main_topic = "this condition"
     if last_question:
-        doc = nlp(last_question.lower())
+        doc = nlp(last_question.lower(), disable=NLP_POS_ONLY)
         for token in doc:
             if token.pos_ in ['NOUN', 'PROPN'] and len(token.text) > 3 and not token.is_stop:
                 main_topic = token.text
@@ -563,12 +1032,12 @@ Generate 4 different follow-up questions about {main_topic} (one per line, no nu
     try:
         response = bedrock.invoke_model(
             modelId=LLM_MODEL,
-            body=json.dumps({
+            body=orjson.dumps({
                 "messages": [{"role": "user", "content": [{"text": prompt}]}],
                 "inferenceConfig": {"maxTokens": 120, "temperature": 0.5, "topP": 0.7}
             })
         )
-        resp_body = json.loads(response["body"].read())
+        resp_body = orjson.loads(response["body"].read())
         suggestions_text = resp_body["output"]["message"]["content"][0]["text"]
         
         suggestions = []
@@ -582,68 +1051,113 @@ Generate 4 different follow-up questions about {main_topic} (one per line, no nu
         print(f"Error generating suggestions: {e}")
         return [f"How to treat {main_topic}?", f"What causes {main_topic}?", f"How long does {main_topic} last?", "When to see a doctor?"]
 
-def filter_relevant_chunks(answer, contexts, processed_query):
-    """Filter contexts to only those that contributed to the answer."""
+def filter_relevant_chunks(contexts, processed_query, top_n=3):
+    """Keep the `top_n` contexts closest to the question by cosine similarity.
+
+    Uses the stored chunk vectors and the (cached) query embedding, so no LLM
+    call is needed; falls back to the first `top_n` contexts when vectors are missing.
+    """
     if not contexts:
         return []
-    
-    # Ask LLM to identify which chunks were actually used
-    chunks_text = "\n\n".join([f"CHUNK {i+1}:\n{c['text'][:500]}" for i, c in enumerate(contexts[:50])])
-    
-    prompt = f"""Given this answer and these chunks, identify which chunk numbers (1-{min(50, len(contexts))}) were actually used to generate the answer.
-Return only the numbers separated by commas (e.g., "1,3,5"). If none were used, return "none".
-
-Answer: {answer}
+    rows = [c.get("_idx") for c in contexts]
+    chunk_vecs = _META_EMB
+    if chunk_vecs is None or any(r is None for r in rows):
+        return contexts[:top_n]
+
+    query_vec = get_embedding(processed_query)
+    sims = chunk_vecs[rows] @ query_vec  # both sides normalized: inner product = cosine
+    order = np.argsort(-sims, kind="stable")[:top_n]
+    return [contexts[i] for i in order]
+
+@dataclass(slots=True)
+class SourceEntry:
+    """One cited document page in an answer; serialized as a JSON object by orjson."""
+    file: str
+    page: Optional[int]
+    key: str
+    url: str
+    highlight: List[str]
 
-Chunks:
-{chunks_text}
-
-Used chunks:"""
+# -------------------------------
+# Approximate answer cache
+# -------------------------------
+# A question is answered from cache when an earlier one retrieved exactly the
+# same chunks with the same chat memory and current patient (the rest of the
+# prompt), has the same content-word lemmas, and its processed query embeds
+# within ANSWER_CACHE_MIN_SIMILARITY (cosine) of it. The lemma check is what
+# tells apart templated questions such as "blood type" / "blood pressure":
+# they embed above the threshold, and a patient question usually retrieves
+# that patient's whole bucket, so the rows match too. Entries expire after
+# ANSWER_CACHE_TTL seconds or when the index files change; presigned source
+# URLs are re-issued on every hit.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MIN_SIMILARITY = float(os.getenv("ANSWER_CACHE_MIN_SIMILARITY", "0.95"))
+# {(context rows, prompt scope, query terms, processed query): (query vector, answer, sources, suggestions, index mtimes)}
+_ANSWER_CACHE = _LRUCache(ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+def _answer_cache_rows(contexts) -> Optional[tuple]:
+    rows = tuple(c.get("_idx") for c in contexts)
+    return None if None in rows else rows
+
+def _answer_cache_scope(memory_context, patient_context) -> bytes:
+    """Digest of the per-session parts of the prompt; answers are only shared
+    between turns whose history and current patient are identical."""
+    return hashlib.blake2b(f"{patient_context}\0{memory_context}".encode("utf-8")).digest()
+
+def _answer_cache_terms(processed_query) -> frozenset:
+    """Lemmas of the question's content words; cached answers must share them."""
+    doc = nlp(processed_query, disable=NLP_POS_AND_LEMMA)
+    return frozenset(token.lemma_.lower() for token in doc if not token.is_stop and not token.is_punct)
+
+def _cached_answer(processed_query, contexts, scope, terms) -> Optional[tuple]:
+    """(answer, sources, suggestions) of a cached near-identical question, or None."""
+    rows = _answer_cache_rows(contexts)
+    if rows is None or ANSWER_CACHE_SIZE <= 0:
+        return None
+    query_vec = get_embedding(processed_query)
+    hit = None
+    for cache_key, entry in _ANSWER_CACHE.items():
+        if entry[4] != _INDEX_MTIMES:
+            _ANSWER_CACHE.pop(cache_key)
+        elif (hit is None and cache_key[:3] == (rows, scope, terms)
+              and float(entry[0] @ query_vec) >= ANSWER_CACHE_MIN_SIMILARITY):
+            hit = cache_key
+    entry = _ANSWER_CACHE.get(hit) if hit is not None else None  # get() also marks it recently used
+    if entry is None:
+        return None
+    _, answer, sources, suggestions, _ = entry
+
+    fresh_sources = []
+    for entry in sources:
+        url = build_presigned_get(entry.key, ttl_sec=600)
+        fresh_sources.append(replace(entry, url=f"{url}#page={entry.page}" if entry.page else url,
+                                     highlight=list(entry.highlight)))
+    print(f"Answer cache hit for: {processed_query}")
+    return answer, fresh_sources, list(suggestions)
+
+def _store_answer(processed_query, contexts, scope, terms, answer, sources, suggestions):
+    rows = _answer_cache_rows(contexts)
+    if rows is None or ANSWER_CACHE_SIZE <= 0:
+        return
+    entry = (get_embedding(processed_query), answer, sources, suggestions, _INDEX_MTIMES)
+    _ANSWER_CACHE.put((rows, scope, terms, processed_query), entry)
+
+def stream_answer_with_sources(question, contexts, session_id="default", processed_query=None):
+    """Yield {"token": ...} events while the answer streams in, then one final
+    {"answer", "sources", "suggestions"} event."""
+    # Patient-specific signals in the original question, used by the checks below
+    original_patient_names = extract_patient_names(question)
+    has_pronouns = bool(_PRONOUN_DETECT.search(question))
     
-    try:
-        response = bedrock.invoke_model(
-            modelId=LLM_MODEL,
-            body=json.dumps({
-                "messages": [{"role": "user", "content": [{"text": prompt}]}],
-                "inferenceConfig": {"maxTokens": 200, "temperature": 0.0}
-            })
-        )
-        resp_body = json.loads(response["body"].read())
-        result = resp_body["output"]["message"]["content"][0]["text"].strip().lower()
-        
-        print("Chunks returned:", response)
-        print("Results returned:", result)
-        
-        if "none" in result:
-            return []
-        
-        # Extract chunk numbers
-        import re
-        numbers = re.findall(r'\d+', result)
-        relevant_contexts = []
-        for num_str in numbers:
-            idx = int(num_str) - 1  # Convert to 0-based index
-            if 0 <= idx < len(contexts):
-                relevant_contexts.append(contexts[idx])
-        
-        return relevant_contexts
-    except Exception as e:
-        print(f"Error filtering chunks: {e}")
-        # Fallback: return first 3 contexts
-        return contexts[:3]
-
-def generate_answer_with_sources(question, contexts, session_id="default", processed_query=None):
     # Use processed query if available, otherwise process the question
     if processed_query is None:
-        processed_query = update_patient_context(question, session_id)
+        processed_query = update_patient_context(question, session_id, patient_names=original_patient_names)
     
     # Check if we have any relevant context
     if not contexts or len(contexts) == 0:
         # Check if this is a general medical question or patient-specific
-        patient_names_in_question = extract_patient_names(question)
-        pronouns = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them']
-        question_words = question.lower().split()
-        has_pronouns = any(pronoun in question_words for pronoun in pronouns)
+        patient_names_in_question = original_patient_names
         
         print(f"DEBUG: patient_names_in_question={patient_names_in_question}, has_pronouns={has_pronouns}")
         
@@ -651,29 +1165,39 @@ def generate_answer_with_sources(question, contexts, session_id="default", proce
         if patient_names_in_question or has_pronouns:
             current_patient_name = get_patient_context(session_id)
             patient_name = current_patient_name or (patient_names_in_question[0] if patient_names_in_question else "unknown patient")
-            return f"No records found for patient '{patient_name}'. Please verify the patient name is correct.", [], []
+            yield {"answer": f"No records found for patient '{patient_name}'. Please verify the patient name is correct.", "sources": [], "suggestions": []}
+            return
         else:
             # For general medical questions, provide general medical information
             print(f"DEBUG: Generating general medical answer for: {question}")
             general_answer = generate_general_medical_answer(question)
-            return f"This information is not available in our knowledge base. {general_answer}", [], []
+            yield {"answer": f"This information is not available in our knowledge base. {general_answer}", "sources": [], "suggestions": []}
+            return
     
     # Check if asking about specific patient but no patient-specific records found
     current_patient_name = get_patient_context(session_id)
-    original_patient_names = extract_patient_names(question)
-    pronouns = ['his', 'her', 'their', 'he', 'she', 'they', 'him', 'them']
-    question_words = question.lower().split()
-    has_pronouns = any(pronoun in question_words for pronoun in pronouns)
     
     # Only check for patient-specific records if the question is actually about a specific patient
-    if current_patient_name and (original_patient_names or has_pronouns) and not any(current_patient_name.lower() in c["text"].lower() for c in contexts):
-        return f"No records found for patient '{current_patient_name}'. Please verify the patient name is correct.", [], []
+    if current_patient_name and (original_patient_names or has_pronouns) and not any(_chunk_is_about(c, current_patient_name.lower()) for c in contexts):
+        yield {"answer": f"No records found for patient '{current_patient_name}'. Please verify the patient name is correct.", "sources": [], "suggestions": []}
+        return
     
     # --- Get last chat history for this session ---
     memory_context = get_memory_context(session_id, max_turns=5)
     
     patient_context = f"\nCurrent patient in conversation: {current_patient_name}" if current_patient_name else ""
 
+    # --- Near-identical question over the same chunks and history: reuse its answer ---
+    cache_scope = _answer_cache_scope(memory_context, patient_context)
+    cache_terms = _answer_cache_terms(processed_query)
+    cached = _cached_answer(processed_query, contexts, cache_scope, cache_terms)
+    if cached:
+        answer, sources, suggestions = cached
+        add_to_memory(session_id, "user", question)
+        add_to_memory(session_id, "assistant", answer)
+        yield {"answer": answer, "sources": sources, "suggestions": suggestions}
+        return
+
     # --- Build context text ---
     context_text = "\n\n".join([c["text"] for c in contexts])
 
@@ -699,88 +1223,104 @@ Processed Question: {processed_query}
 
 Answer:"""
 
-    # --- Call LLM ---
-    response = bedrock.invoke_model(
-        modelId=LLM_MODEL,
-        body=json.dumps({
-            "messages": [{"role": "user", "content": [{"text": prompt}]}],
-            "inferenceConfig": {"maxTokens": 1000, "temperature": 0.2, "topP": 0.9}
-        })
-    )
-    resp_body = json.loads(response["body"].read())
-    answer = resp_body["output"]["message"]["content"][0]["text"]
+    # --- Suggestions depend only on the question, so generate them while the answer streams ---
+    suggestions_future = _executor.submit(generate_query_suggestions, session_id, contexts, question)
+
+    # --- Source chunks and their highlights depend only on the processed question too:
+    # pick them now and extract all highlights in one batch while the answer streams
+    # (sentences are embedded on _embed_executor) ---
+    relevant_contexts = filter_relevant_chunks(contexts, processed_query)
+    print(f"Filtered from {len(contexts)} to {len(relevant_contexts)} relevant chunks")
+    highlights_future = _executor.submit(extract_highlights_batch, processed_query, [c["text"] for c in relevant_contexts])
+
+    # --- Call LLM (streamed, so the first tokens reach the user right away) ---
+    answer_parts = []
+    for token in stream_llm_text(prompt, {"maxTokens": 1000, "temperature": 0.2, "topP": 0.9}):
+        answer_parts.append(token)
+        yield {"token": token}
+    answer = "".join(answer_parts)
 
     # --- Save Q&A into memory ---
     add_to_memory(session_id, "user", question)
     add_to_memory(session_id, "assistant", answer)
 
-    # --- Filter contexts to only those that contributed to the answer ---
-    relevant_contexts = filter_relevant_chunks(answer, contexts, processed_query)
-    print(f"Filtered from {len(contexts)} to {len(relevant_contexts)} relevant chunks")
-    
+    # --- The model said the records do not answer this: nothing to cite ---
+    not_in_kb = answer.startswith("This information is not available")
+    if not_in_kb:
+        highlights_future.cancel()  # no-op if it already started
+        relevant_contexts = []
+
     # --- Extract sources + highlights from relevant contexts only ---
     sources = []
-    seen = {}
+    source_pos = {}  # (key, page) -> position in sources
+    url_cache = {}  # key -> presigned URL for this response
     valid_highlights_found = False
     
-    for c in relevant_contexts:
-        hl = extract_highlight(processed_query, c["text"]) or ""
-        norm = hl.strip().lower()
-        
-        # Skip if no highlight
-        if not norm or "does not contain" in norm:
+    highlights = highlights_future.result() if relevant_contexts else []
+    for c, hl in zip(relevant_contexts, highlights):
+        # Highlights are a verbatim chunk sentence or "N/A" when none is relevant
+        if not hl or hl == "N/A":
             continue
             
         valid_highlights_found = True
 
-        raw = c.get("source") or c.get("s3_key") or c.get("file") or ""
-        key = normalize_s3_key(raw)
+        # Search hits carry their precomputed key; other contexts are normalized here
+        key = c["_src"] if "_src" in c else normalize_s3_key(c.get("source") or c.get("s3_key") or c.get("file") or "")
         if not key:
             continue
 
-        # choose presigned (private bucket) or public
-        url = build_presigned_get(key, ttl_sec=600)
         page = c.get("page")
-        if page:
-            url = f"{url}#page={page}"
-
-        file_name = c.get("file") or key.split("/")[-1]
         dedup_key = (key, page)
 
-        if dedup_key not in seen:
-            seen[dedup_key] = {
-                "file": file_name,
-                "page": page,
-                "key": key,
-                "url": url,
-                "highlight": set()
-            }
-
-        if hl.strip() and "does not contain" not in hl.lower():
-            seen[dedup_key]["highlight"].add(hl.strip())
-
-    for entry in seen.values():
-        entry["highlight"] = list(entry["highlight"])
-        sources.append(entry)
+        pos = source_pos.get(dedup_key)
+        if pos is None:
+            # choose presigned (private bucket) or public; signed once per document
+            base_url = url_cache.get(key)
+            if base_url is None:
+                base_url = url_cache[key] = build_presigned_get(key, ttl_sec=600)
+            url = f"{base_url}#page={page}" if page else base_url
+            file_name = c.get("file") or key.split("/")[-1]
+            source_pos[dedup_key] = len(sources)
+            sources.append(SourceEntry(file=file_name, page=page, key=key, url=url, highlight=[hl]))
+        else:
+            # At most a few highlights per source: a list keeps them in chunk order
+            highlights = sources[pos].highlight
+            if hl not in highlights:
+                highlights.append(hl)
         
     # If no valid highlights found, add disclaimer to answer
-    if not valid_highlights_found and not answer.startswith("This information is not available"):
+    if not valid_highlights_found and not not_in_kb:
         general_answer = generate_general_medical_answer(question)
         answer = f"This information is not available in our knowledge base. {general_answer}"
 
-    # --- Generate suggestions ---
-    suggestions = generate_query_suggestions(session_id, contexts)
+    # --- Collect suggestions (started before the answer) ---
+    suggestions = suggestions_future.result()
+    _store_answer(processed_query, contexts, cache_scope, cache_terms, answer, sources, suggestions)
 
-    return answer, sources, suggestions
+    yield {"answer": answer, "sources": sources, "suggestions": suggestions}
 
+def generate_answer_with_sources(question, contexts, session_id="default", processed_query=None):
+    """Blocking wrapper around stream_answer_with_sources; returns (answer, sources, suggestions)."""
+    for event in stream_answer_with_sources(question, contexts, session_id, processed_query):
+        if "answer" in event:
+            return event["answer"], event["sources"], event["suggestions"]
 
 
 
 # -------------------------------
 # Main
 # -------------------------------
+def _warmup():
+    """Pay the one-time load costs before the first question instead of during it."""
+    try:
+        _load_index()  # index, metadata columns, gazetteer, inverted index, chunk vectors
+    except FileNotFoundError as e:
+        print(e)
+    nlp("Warm up the tagger and NER.", disable=NLP_ENTS_AND_POS)
+
 if __name__ == "__main__":
     session_id = "test_session"
+    _warmup()
     while True:
         q = input("Ask Anything> ")
         if q.lower() in ['quit', 'exit']:
@@ -796,13 +1336,21 @@ if __name__ == "__main__":
         for c in contexts:
             print("-", c["text"][:200], "...")
 
-        answer, sources, suggestions = generate_answer_with_sources(q, contexts, session_id, processed_q)
-
-        print("\n🤖 Nova Pro Answer:\n", answer)
+        print("\n🤖 Nova Pro Answer:")
+        streamed = ""
+        for event in stream_answer_with_sources(q, contexts, session_id, processed_q):
+            if "token" in event:
+                streamed += event["token"]
+                print(event["token"], end="", flush=True)
+        answer, sources, suggestions = event["answer"], event["sources"], event["suggestions"]
+        if answer != streamed:
+            # Early exits and the general-answer fallback replace the streamed text
+            print(("\n" if streamed else "") + answer, end="")
+        print()
         print("\n📚 Sources:")
         for s in sources:
-            print(f"- {s['key']} (Page {s['page']})")
-            print(f"  🔎 Highlight: {s['highlight']}\n")
+            print(f"- {s.key} (Page {s.page})")
+            print(f"  🔎 Highlight: {s.highlight}\n")
         
         print("\n💡 Suggested Questions:")
         for i, suggestion in enumerate(suggestions, 1):